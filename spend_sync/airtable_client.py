@@ -1,19 +1,56 @@
+import datetime as dt
+import logging
 import math
-from typing import Dict, Iterable, List, Optional
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import json_codec
+from .disk_cache import DiskCache
+from .rate_limiter import RateLimiter
 
 AIRTABLE_API_URL = "https://api.airtable.com/v0"
+AIRTABLE_POOL_SIZE = 8
+AIRTABLE_MAX_PAGE_SIZE = 100
+AIRTABLE_MAX_CALLS_PER_SECOND = 5
+AIRTABLE_WRITE_WORKERS = 5
+ID_INDEX_MAX_AGE_SECONDS = 7 * 24 * 3600
+ID_INDEX_CLOCK_SKEW = dt.timedelta(minutes=5)
+AIRTABLE_WRITE_ATTEMPTS = 3
+# Airtable asks clients that hit the per-base limit to back off for 30 seconds.
+AIRTABLE_RATE_LIMIT_BACKOFF_SECONDS = 30.0
+
+logger = logging.getLogger(__name__)
 
 
 class AirtableError(RuntimeError):
-    pass
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _retry_after_seconds(response: requests.Response) -> float:
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return max(float(header), 1.0)
+        except (TypeError, ValueError):
+            pass
+    return AIRTABLE_RATE_LIMIT_BACKOFF_SECONDS
 
 
 class AirtableClient:
-    def __init__(self, api_key: str, base_id: str):
+    def __init__(self, api_key: str, base_id: str, cache: Optional[DiskCache] = None):
         self.api_key = api_key
         self.base_id = base_id
+        self.cache = cache
+        self._session = self._build_session()
+        self._rate_limiter = RateLimiter(max_calls=AIRTABLE_MAX_CALLS_PER_SECOND, per_seconds=1.0)
+        self._metric_records: Dict[Tuple[str, str], Dict] = {}
 
     @property
     def headers(self) -> Dict[str, str]:
@@ -22,51 +59,144 @@ class AirtableClient:
             "Content-Type": "application/json",
         }
 
+    def _build_session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers.update(self.headers)
+        retry = Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AIRTABLE_POOL_SIZE, max_retries=retry)
+        session.mount("https://", adapter)
+        return session
+
     def _request(self, method: str, table: str, **kwargs) -> Dict:
         url = f"{AIRTABLE_API_URL}/{self.base_id}/{table}"
-        response = requests.request(method, url, headers=self.headers, **kwargs)
+        if "json" in kwargs:
+            kwargs["data"] = json_codec.dumps(kwargs.pop("json"))
+        for attempt in range(1, AIRTABLE_WRITE_ATTEMPTS + 1):
+            self._rate_limiter.wait()
+            response = self._session.request(method, url, **kwargs)
+            # urllib3 already retries 429s on idempotent methods; PATCH/POST come back here.
+            throttled_write = response.status_code == 429 and method not in Retry.DEFAULT_ALLOWED_METHODS
+            if not throttled_write or attempt == AIRTABLE_WRITE_ATTEMPTS:
+                break
+            delay = _retry_after_seconds(response)
+            logger.warning(
+                "Airtable rate limited %s %s. Sleeping %.1fs before retry %s/%s.",
+                method,
+                table,
+                delay,
+                attempt,
+                AIRTABLE_WRITE_ATTEMPTS - 1,
+            )
+            time.sleep(delay)
         if response.status_code >= 400:
-            raise AirtableError(f"{method} {url} failed: {response.status_code} {response.text}")
-        return response.json()
-
-    def iter_records(self, table: str, fields: Optional[List[str]] = None, filter_formula: Optional[str] = None):
+            raise AirtableError(
+                f"{method} {url} failed: {response.status_code} {response.text}",
+                status_code=response.status_code,
+            )
+        return json_codec.loads(response.content)
+
+    def iter_records(
+        self,
+        table: str,
+        fields: Optional[List[str]] = None,
+        filter_formula: Optional[str] = None,
+        cached: bool = False,
+        page_size: Optional[int] = None,
+    ):
         params: Dict[str, object] = {}
         if fields:
             params["fields[]"] = fields
         if filter_formula:
             params["filterByFormula"] = filter_formula
-
-        offset = None
-        while True:
-            if offset:
-                params["offset"] = offset
-            else:
-                params.pop("offset", None)
-            payload = self._request("GET", table, params=params)
-            for record in payload.get("records", []):
-                yield record
-            offset = payload.get("offset")
-            if not offset:
-                break
+        if page_size:
+            params["pageSize"] = min(page_size, AIRTABLE_MAX_PAGE_SIZE)
+
+        if not cached or self.cache is None:
+            yield from self._paginate(table, params)
+            return
+
+        # Offsets expire server-side, so whole listings are cached rather than single pages.
+        cache_key = ("records", self.base_id, table, fields or [], filter_formula or "")
+        records = self.cache.get(cache_key)
+        if records is not None:
+            yield from records
+            return
+        records = []
+        for record in self._paginate(table, params):
+            records.append(record)
+            yield record
+        self.cache.set(cache_key, records)
+
+    def _paginate(self, table: str, params: Dict[str, object]):
+        # Airtable only hands out the next offset with each page, so pages cannot be
+        # requested in parallel; instead fetch page N+1 while callers consume page N.
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            pending = prefetcher.submit(self._request, "GET", table, params=dict(params))
+            while True:
+                payload = pending.result()
+                offset = payload.get("offset")
+                if offset:
+                    pending = prefetcher.submit(self._request, "GET", table, params={**params, "offset": offset})
+                for record in payload.get("records", []):
+                    yield record
+                if not offset:
+                    break
+
+    def _write_batches(self, method: str, table: str, records: List[Dict], chunk_size: int) -> None:
+        batches = [{"records": records[i : i + chunk_size]} for i in range(0, len(records), chunk_size)]
+        if len(batches) <= 1:
+            for batch in batches:
+                self._request(method, table, json=batch)
+            return
+        with ThreadPoolExecutor(max_workers=AIRTABLE_WRITE_WORKERS) as pool:
+            futures = [pool.submit(self._request, method, table, json=batch) for batch in batches]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                error = future.exception()
+                if error is not None:
+                    for other in pending:
+                        other.cancel()
+                    raise error
 
     def update_records(self, table: str, records: List[Dict], chunk_size: int = 10) -> None:
-        for i in range(0, len(records), chunk_size):
-            batch = {"records": records[i : i + chunk_size]}
-            self._request("PATCH", table, json=batch)
+        self._write_batches("PATCH", table, records, chunk_size)
 
     def create_records(self, table: str, records: List[Dict], chunk_size: int = 10) -> None:
-        for i in range(0, len(records), chunk_size):
-            batch = {"records": records[i : i + chunk_size]}
-            self._request("POST", table, json=batch)
+        self._write_batches("POST", table, records, chunk_size)
 
-    def upsert_by_id(self, table: str, records: Iterable[Dict]) -> None:
+    def _scan_id_index(self, table: str, filter_formula: Optional[str] = None) -> Dict[str, str]:
         existing = {}
-        for record in self.iter_records(table, fields=["id"]):
+        for record in self.iter_records(table, fields=["id"], filter_formula=filter_formula):
             fields = record.get("fields", {})
             identifier = fields.get("id")
             if identifier:
                 existing[str(identifier)] = record["id"]
-
+        return existing
+
+    def _load_id_index(self, table: str, refresh: bool = False) -> Tuple[Dict[str, str], bool]:
+        """Return the id -> Airtable record id map for table and whether it was served incrementally."""
+        if self.cache is None:
+            return self._scan_id_index(table), False
+
+        cache_key = ("id-index", self.base_id, table)
+        # Step back a little so edits racing with this scan are picked up next time.
+        scanned_at = (dt.datetime.now(dt.timezone.utc) - ID_INDEX_CLOCK_SKEW).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        entry = None if refresh else self.cache.get(cache_key, max_age=ID_INDEX_MAX_AGE_SECONDS)
+        if entry:
+            existing = entry["map"]
+            formula = f"IS_AFTER(LAST_MODIFIED_TIME(), '{entry['scanned_at']}')"
+            existing.update(self._scan_id_index(table, filter_formula=formula))
+        else:
+            existing = self._scan_id_index(table)
+        self.cache.set(cache_key, {"scanned_at": scanned_at, "map": existing})
+        return existing, bool(entry)
+
+    def _apply_upsert(self, table: str, records: List[Dict], existing: Dict[str, str]) -> None:
         updates: List[Dict] = []
         creates: List[Dict] = []
         for payload in records:
@@ -82,11 +212,31 @@ class AirtableClient:
         if creates:
             self.create_records(table, creates)
 
+    def upsert_by_id(self, table: str, records: Iterable[Dict]) -> None:
+        records = list(records)
+        existing, incremental = self._load_id_index(table)
+        try:
+            self._apply_upsert(table, records, existing)
+        except AirtableError:
+            if not incremental:
+                raise
+            # Deleted rows are invisible to the incremental scan; rebuild the index and retry once.
+            existing, _ = self._load_id_index(table, refresh=True)
+            self._apply_upsert(table, records, existing)
+
     def update_single_record(self, table: str, record_id: str, fields: Dict[str, object]) -> None:
         self._request("PATCH", table, json={"records": [{"id": record_id, "fields": fields}]})
+        for key, record in list(self._metric_records.items()):
+            if key[0] == table and record.get("id") == record_id:
+                del self._metric_records[key]
 
     def get_single_record(self, table: str, metric_name: str) -> Dict:
-        records = list(self.iter_records(table, filter_formula=f"{{Metric}} = '{metric_name}'"))
-        if not records:
-            raise AirtableError(f"Metric '{metric_name}' not found in {table}")
-        return records[0]
+        # The monthly and daily KPI updates read the same metric rows; keep them for the client's lifetime.
+        key = (table, metric_name)
+        record = self._metric_records.get(key)
+        if record is None:
+            records = list(self.iter_records(table, filter_formula=f"{{Metric}} = '{metric_name}'"))
+            if not records:
+                raise AirtableError(f"Metric '{metric_name}' not found in {table}")
+            record = self._metric_records[key] = records[0]
+        return record
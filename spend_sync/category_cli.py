@@ -3,7 +3,9 @@ import os
 
 from .airtable_client import AirtableClient
 from .category_kpi import update_category_monthly_counts
+from .config import add_cache_arguments
 from .date_windows import dubai_now, monthly_windows
+from .disk_cache import DiskCache
 
 DEFAULT_ORDERS_TABLE = "Mamo Transactions"
 DEFAULT_CATEGORY_TABLE = "KPI Category Monthly"
@@ -42,6 +44,7 @@ def build_parser() -> argparse.ArgumentParser:
         default=category_default,
         help=f"Category KPI table identifier (default: env or '{DEFAULT_CATEGORY_TABLE}').",
     )
+    add_cache_arguments(parser)
     return parser
 
 
@@ -58,7 +61,10 @@ def main(argv=None) -> None:
     if warn_env:
         print(f"PYTHONWARNINGS={warn_env}", flush=True)
 
-    airtable = AirtableClient(args.airtable_api_key, args.airtable_base_id)
+    cache = None
+    if args.airtable_cache_dir and not args.no_cache:
+        cache = DiskCache(args.airtable_cache_dir, args.airtable_cache_ttl)
+    airtable = AirtableClient(args.airtable_api_key, args.airtable_base_id, cache=cache)
 
     previous_start, previous_end, current_start, current_end = monthly_windows(dubai_now())
     previous_window = (previous_start, previous_end)
@@ -1,10 +1,13 @@
 import datetime as dt
-from collections import defaultdict
-from typing import Dict, Iterable, List, Optional, Tuple
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from .airtable_client import AirtableClient
+from .airtable_client import AIRTABLE_MAX_PAGE_SIZE, AirtableClient, AirtableError
+from .date_windows import DUBAI_OFFSET, DUBAI_TZ
 
-DUBAI_OFFSET = dt.timedelta(hours=4)
 STATUS_FIELD = "status"
 STATUS_EXPECTED = "captured"
 DATE_FIELD = "created_date"
@@ -16,18 +19,87 @@ CATEGORY_FALLBACKS = (
     "Product category",
     "product category",
 )
+ORDER_SCAN_FIELDS = [STATUS_FIELD, DATE_FIELD, CATEGORY_FIELD]
+
+# Shapes previously probed with strptime, e.g. "2024-05-12 03:14[:00]" or "12/05/2024 03:14PM".
+_YEAR_FIRST_RE = re.compile(r"(\d{4})([-/])(\d{1,2})\2(\d{1,2})(?:\s+(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?")
+_DAY_FIRST_RE = re.compile(r"(\d{1,2})/(\d{1,2})/(\d{4})(?:\s+(\d{1,2}):(\d{1,2})([AaPp][Mm])?)?")
+# Airtable's own timestamp shape, e.g. "2024-05-12T03:14:00.000Z".
+_UTC_TIMESTAMP_RE = re.compile(r"\d{4}-\d{2}-\d{2}T(?:[01]\d|2[0-3]):[0-5]\d(?::[0-5]\d(?:\.\d+)?)?Z")
+_DUBAI_ROLLOVER_HOUR = 24 - DUBAI_OFFSET.seconds // 3600
+_ONE_DAY = dt.timedelta(days=1)
+
+
+class _FieldResolver:
+    """Look up a logical field under its preferred column name, then its fallbacks."""
+
+    __slots__ = ("preferred", "fallbacks")
+
+    def __init__(self, preferred: str, fallbacks: Iterable[str] = ()) -> None:
+        self.preferred = preferred
+        self.fallbacks = tuple(fallbacks)
+
+    def __call__(self, fields: Dict[str, object]) -> object:
+        # Airtable omits empty cells, so the matching column can differ per record.
+        if self.preferred in fields:
+            return fields[self.preferred]
+        for candidate in self.fallbacks:
+            if candidate in fields:
+                return fields[candidate]
+        return None
+
+
+_resolve_status = _FieldResolver(STATUS_FIELD, ("Status",))
+_resolve_order_date = _FieldResolver(DATE_FIELD, ("Order Date", "date", "Date", "Created Date", "createdDate"))
+_resolve_category = _FieldResolver(CATEGORY_FIELD, CATEGORY_FALLBACKS)
+
+
+@lru_cache(maxsize=2048)
+def _normalize_text(text: str) -> str:
+    return text.strip().lower()
 
 
 def _normalize(value: object) -> str:
     if value is None:
         return ""
+    if isinstance(value, str):
+        return _normalize_text(value)
     if isinstance(value, dict):
         name = value.get("name")
         if isinstance(name, str):
-            return name.strip().lower()
+            return _normalize_text(name)
     if isinstance(value, list) and value:
         return _normalize(value[0])
-    return str(value).strip().lower()
+    return _normalize_text(str(value))
+
+
+def _build_datetime(year: int, month: int, day: int, hour: int = 0, minute: int = 0, second: int = 0) -> Optional[dt.datetime]:
+    try:
+        return dt.datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        return None
+
+
+def _parse_datetime_text(text: str) -> Optional[dt.datetime]:
+    match = _YEAR_FIRST_RE.fullmatch(text)
+    if match:
+        year, _, month, day, hour, minute, second = match.groups()
+        return _build_datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+
+    match = _DAY_FIRST_RE.fullmatch(text)
+    if not match:
+        return None
+    first, second_part, year, hour_text, minute_text, meridiem = match.groups()
+    hour = int(hour_text or 0)
+    minute = int(minute_text or 0)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.lower() == "pm" else 0)
+    # Day-first wins when both readings are valid, matching the old format order.
+    return _build_datetime(int(year), int(second_part), int(first), hour, minute) or _build_datetime(
+        int(year), int(first), int(second_part), hour, minute
+    )
 
 
 def _parse_airtable_datetime(value: object) -> Optional[dt.datetime]:
@@ -46,24 +118,7 @@ def _parse_airtable_datetime(value: object) -> Optional[dt.datetime]:
             return dt.datetime.fromisoformat(candidate)
         except ValueError:
             pass
-        for fmt in (
-            "%Y-%m-%d %H:%M:%S",
-            "%Y-%m-%d %H:%M",
-            "%Y-%m-%d",
-            "%Y/%m/%d %H:%M:%S",
-            "%Y/%m/%d %H:%M",
-            "%Y/%m/%d",
-            "%d/%m/%Y %I:%M%p",
-            "%d/%m/%Y %H:%M",
-            "%d/%m/%Y",
-            "%m/%d/%Y %I:%M%p",
-            "%m/%d/%Y %H:%M",
-            "%m/%d/%Y",
-        ):
-            try:
-                return dt.datetime.strptime(text, fmt)
-            except ValueError:
-                continue
+        return _parse_datetime_text(text)
     return None
 
 
@@ -81,141 +136,228 @@ def _parse_airtable_date(value: object) -> Optional[dt.date]:
                 return dt.date.fromisoformat(text[:10])
             except ValueError:
                 pass
-        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y"):
-            try:
-                return dt.datetime.strptime(text[:10], fmt).date()
-            except ValueError:
-                continue
+        head = text[:10]
+        match = _YEAR_FIRST_RE.fullmatch(head)
+        if match and match.group(2) != "-":
+            return None
+        parsed = _parse_datetime_text(head)
+        if parsed:
+            return parsed.date()
     return None
 
 
+def _utc_text_to_dubai_date(text: str) -> Optional[dt.date]:
+    if not _UTC_TIMESTAMP_RE.fullmatch(text):
+        return None
+    # The Dubai date depends only on the UTC date and hour, and orders share a few thousand of those.
+    return _utc_hour_to_dubai_date(text[:13])
+
+
+@lru_cache(maxsize=4096)
+def _utc_hour_to_dubai_date(prefix: str) -> Optional[dt.date]:
+    try:
+        date = dt.date(int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]))
+    except ValueError:
+        return None
+    return date + _ONE_DAY if int(prefix[11:13]) >= _DUBAI_ROLLOVER_HOUR else date
+
+
 def _to_dubai_date(value: object) -> Optional[dt.date]:
+    if isinstance(value, str):
+        return _utc_text_to_dubai_date(value) or _text_to_dubai_date(value)
+    return _convert_to_dubai_date(value)
+
+
+def _convert_to_dubai_date(value: object) -> Optional[dt.date]:
     dt_value = _parse_airtable_datetime(value)
     if dt_value:
         if dt_value.tzinfo:
-            utc_dt = dt_value.astimezone(dt.timezone.utc).replace(tzinfo=None)
-        else:
-            utc_dt = dt_value
-        return (utc_dt + DUBAI_OFFSET).date()
+            return dt_value.astimezone(DUBAI_TZ).date()
+        # Naive values are UTC wall-clock times.
+        return (dt_value + DUBAI_OFFSET).date()
     return _parse_airtable_date(value)
 
 
-def _extract_categories(value: object) -> List[str]:
-    entries: Iterable[str]
-    if isinstance(value, list):
-        entries = [str(item) for item in value if str(item).strip()]
-    elif isinstance(value, str):
-        entries = [value]
-    else:
-        return []
+@lru_cache(maxsize=65536)
+def _text_to_dubai_date(text: str) -> Optional[dt.date]:
+    return _convert_to_dubai_date(text)
 
-    results = []
-    for entry in entries:
-        for part in entry.split(","):
-            label = part.strip()
-            if label:
-                results.append(label)
-    return list(dict.fromkeys(results))
 
+@lru_cache(maxsize=4096)
+def _split_categories(text: str) -> Tuple[str, ...]:
+    labels = (part.strip() for part in text.split(","))
+    return tuple(dict.fromkeys(label for label in labels if label))
 
-def _format_count(value: int) -> str:
-    return f"{value:,d}" if value else "0"
 
+def _merge_category_items(items: Iterable[object]) -> Tuple[str, ...]:
+    results = [label for item in items for label in _split_categories(str(item))]
+    return tuple(dict.fromkeys(results))
 
-def update_category_monthly_counts(
-    airtable: AirtableClient,
-    orders_table: str,
-    category_table: str,
-    previous_window: Tuple[dt.date, dt.date],
-    current_window: Tuple[dt.date, dt.date],
-) -> Dict[str, object]:
-    previous_start, previous_end = previous_window
-    current_start, current_end = current_window
 
-    month_previous_label = previous_start.strftime("%B")
-    month_current_label = current_start.strftime("%B")
+_merge_category_items_cached = lru_cache(maxsize=4096)(_merge_category_items)
 
-    counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {month_previous_label: 0, month_current_label: 0})
 
-    order_records = airtable.iter_records(orders_table)
+def _extract_categories(value: object) -> Tuple[str, ...]:
+    if isinstance(value, str):
+        return _split_categories(value)
+    if not isinstance(value, list):
+        return ()
+    # Most linked-record lookups hold a single label; skip building the tuple cache key.
+    if len(value) == 1 and type(value[0]) is str:
+        return _split_categories(value[0])
+    try:
+        return _merge_category_items_cached(tuple(value))
+    except TypeError:  # unhashable items such as nested objects
+        return _merge_category_items(value)
+
+
+def _category_label(value: object) -> str:
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value.strip() if isinstance(value, str) else ""
 
-    range_start = previous_start
-    range_end = current_end
 
-    def resolve_field(fields: Dict[str, object], preferred: str, fallbacks: Iterable[str]) -> object:
-        candidates = [preferred, *fallbacks]
-        for candidate in candidates:
-            if candidate in fields:
-                return fields[candidate]
-        return None
+def _load_category_index(airtable: AirtableClient, category_table: str, category_field_name: str) -> Dict[str, str]:
+    return {
+        name: record["id"]
+        for record in airtable.iter_records(category_table, fields=[category_field_name])
+        if (name := _category_label(record.get("fields", {}).get(category_field_name)))
+    }
+
 
-    for record in order_records:
+def _date_window_formula(field: str, start: dt.date, end: dt.date) -> str:
+    # Pad both ends so Dubai-local days are never cut by the UTC comparison Airtable does.
+    after = (start - dt.timedelta(days=2)).isoformat()
+    before = (end + dt.timedelta(days=2)).isoformat()
+    return f"AND(IS_AFTER({{{field}}}, '{after}'), IS_BEFORE({{{field}}}, '{before}'))"
+
+
+def _iter_order_values(
+    airtable: AirtableClient, orders_table: str, filter_formula: str
+) -> Iterator[Tuple[object, object, object]]:
+    yielded = False
+    try:
+        records = airtable.iter_records(
+            orders_table,
+            fields=ORDER_SCAN_FIELDS,
+            filter_formula=filter_formula,
+            cached=True,
+            page_size=AIRTABLE_MAX_PAGE_SIZE,
+        )
+        for values in _project_scanned_orders(records):
+            yielded = True
+            yield values
+    except AirtableError as exc:
+        # 422 means the table does not use the preferred field names; scan everything instead.
+        if yielded or exc.status_code != 422:
+            raise
+        records = airtable.iter_records(orders_table, cached=True, page_size=AIRTABLE_MAX_PAGE_SIZE)
+        yield from _project_orders(records)
+
+
+def _project_scanned_orders(records: Iterable[Dict[str, object]]) -> Iterator[Tuple[object, object, object]]:
+    """Projection for scans restricted to ORDER_SCAN_FIELDS, where fallback columns cannot appear."""
+    for record in records:
         fields = record.get("fields", {})
+        yield fields.get(STATUS_FIELD), fields.get(DATE_FIELD), fields.get(CATEGORY_FIELD)
 
-        status_value = resolve_field(fields, STATUS_FIELD, ("Status",))
-        if _normalize(status_value) != STATUS_EXPECTED:
-            continue
 
-        order_date_value = resolve_field(
-            fields,
-            DATE_FIELD,
-            ("Order Date", "date", "Date", "Created Date", "createdDate"),
-        )
+def _project_orders(records: Iterable[Dict[str, object]]) -> Iterator[Tuple[object, object, object]]:
+    """Reduce each order record to its (status, order date, category) values."""
+    for record in records:
+        fields = record.get("fields", {})
+        yield _resolve_status(fields), _resolve_order_date(fields), _resolve_category(fields)
+
+
+def _count_categories(
+    order_values: Iterable[Tuple[object, object, object]],
+    previous_window: Tuple[dt.date, dt.date],
+    current_window: Tuple[dt.date, dt.date],
+) -> Tuple[Counter, Counter]:
+    # Window bounds as day ordinals so each record costs plain int comparisons.
+    previous_start, previous_end = (day.toordinal() for day in previous_window)
+    current_start, current_end = (day.toordinal() for day in current_window)
+    if previous_end >= current_start:
+        raise ValueError("previous window must end before the current window starts")
+    range_start = previous_start
+    range_end = current_end
+
+    previous_counts: Counter = Counter()
+    current_counts: Counter = Counter()
+
+    for status_value, order_date_value, category_value in order_values:
+        # Almost every status is already the exact lowercase string; only normalize the rest,
+        # keeping the _normalize call for the rare dict/list shapes.
+        if status_value != STATUS_EXPECTED:
+            if type(status_value) is str:
+                if status_value.strip().lower() != STATUS_EXPECTED:
+                    continue
+            elif _normalize(status_value) != STATUS_EXPECTED:
+                continue
+
         order_date = _to_dubai_date(order_date_value)
         if not order_date:
             continue
-        if order_date < range_start or order_date > range_end:
+        order_day = order_date.toordinal()
+        if order_day < range_start or order_day > range_end:
             continue
 
-        category_value = resolve_field(fields, CATEGORY_FIELD, CATEGORY_FALLBACKS)
         categories = _extract_categories(category_value)
         if not categories:
             continue
 
-        in_previous = previous_start <= order_date <= previous_end
-        in_current = current_start <= order_date <= current_end
-        if not in_previous and not in_current:
-            continue
+        # The range gate already bounds order_day; the windows are disjoint, so one side check each.
+        if order_day <= previous_end:
+            previous_counts.update(categories)
+        elif order_day >= current_start:
+            current_counts.update(categories)
 
-        for category in categories:
-            bucket = counts[category]
-            if in_previous:
-                bucket[month_previous_label] += 1
-            if in_current:
-                bucket[month_current_label] += 1
+    return previous_counts, current_counts
 
-    category_field_name = "Category"
-    existing_records: Dict[str, str] = {}
-    for record in airtable.iter_records(category_table):
-        fields = record.get("fields", {})
-        name = fields.get(category_field_name)
-        if isinstance(name, list):
-            name = name[0] if name else None
-        if not isinstance(name, str):
-            continue
-        normalized = name.strip()
-        if not normalized:
-            continue
-        existing_records[normalized] = record["id"]
 
-    all_categories = set(counts.keys()) | set(existing_records.keys())
+def _format_count(value: int) -> str:
+    return f"{value:,d}" if value else "0"
 
-    def totals(category: str) -> Tuple[int, int]:
-        bucket = counts.get(category)
-        if not bucket:
-            return 0, 0
-        return bucket.get(month_current_label, 0), bucket.get(month_previous_label, 0)
 
+def update_category_monthly_counts(
+    airtable: AirtableClient,
+    orders_table: str,
+    category_table: str,
+    previous_window: Tuple[dt.date, dt.date],
+    current_window: Tuple[dt.date, dt.date],
+) -> Dict[str, object]:
+    previous_start, previous_end = previous_window
+    current_start, current_end = current_window
+
+    month_previous_label = previous_start.strftime("%B")
+    month_current_label = current_start.strftime("%B")
+
+    window_formula = _date_window_formula(DATE_FIELD, previous_start, current_end)
+    order_values = _iter_order_values(airtable, orders_table, window_formula)
+
+    category_field_name = "Category"
+    # The category table is small; read it alongside the orders scan instead of after it.
+    with ThreadPoolExecutor(max_workers=1) as background:
+        existing_future = background.submit(_load_category_index, airtable, category_table, category_field_name)
+        previous_counts, current_counts = _count_categories(order_values, previous_window, current_window)
+        existing_records = existing_future.result()
+
+    all_categories = set(previous_counts) | set(current_counts) | set(existing_records)
+
+    totals: Dict[str, Tuple[int, int]] = {
+        category: (current_counts.get(category, 0), previous_counts.get(category, 0))
+        for category in all_categories
+    }
     sorted_categories = sorted(
         all_categories,
-        key=lambda cat: (-totals(cat)[0], -totals(cat)[1], cat.lower()),
+        key=lambda cat: (-totals[cat][0], -totals[cat][1], cat.lower()),
     )
 
     updates: List[Dict[str, object]] = []
     creates: List[Dict[str, object]] = []
 
     for category in sorted_categories:
-        current_total, previous_total = totals(category)
+        current_total, previous_total = totals[category]
         fields_payload: Dict[str, object] = {
             month_previous_label: _format_count(previous_total),
             month_current_label: _format_count(current_total),
@@ -235,8 +377,8 @@ def update_category_monthly_counts(
 
     totals_by_category = {
         category: {
-            month_previous_label: totals(category)[1],
-            month_current_label: totals(category)[0],
+            month_previous_label: totals[category][1],
+            month_current_label: totals[category][0],
         }
         for category in sorted_categories
     }
@@ -27,6 +27,8 @@ class RuntimeConfig:
     category_kpi_table_id: Optional[str]
     category_kpi_table_name: Optional[str]
     orders_table: Optional[str]
+    airtable_cache_dir: Optional[str]
+    airtable_cache_ttl: float
 
 
 def parse_account_ids(raw: Optional[str]) -> List[str]:
@@ -43,6 +45,25 @@ def parse_account_ids(raw: Optional[str]) -> List[str]:
     return result
 
 
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--airtable-cache-dir",
+        default=os.getenv("AIRTABLE_CACHE_DIR"),
+        help="Directory for caching Airtable order scans between runs (default: $AIRTABLE_CACHE_DIR; disabled if unset).",
+    )
+    parser.add_argument(
+        "--airtable-cache-ttl",
+        type=float,
+        default=float(os.getenv("AIRTABLE_CACHE_TTL_SECONDS", "3600") or 3600),
+        help="Seconds a cached Airtable scan stays valid (default: $AIRTABLE_CACHE_TTL_SECONDS or 3600).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore the Airtable cache directory for this run.",
+    )
+
+
 def add_common_arguments(parser: argparse.ArgumentParser) -> None:
     orders_default = (
         os.getenv("AIRTABLE_ORDERS_TABLE_NAME")
@@ -100,6 +121,7 @@ def add_common_arguments(parser: argparse.ArgumentParser) -> None:
         help="Airtable orders table identifier for category KPI updates "
         "(default: env or 'Mamo Transactions').",
     )
+    add_cache_arguments(parser)
 
 
 def build_config(args: argparse.Namespace, required_start: dt.date) -> RuntimeConfig:
@@ -179,4 +201,6 @@ def build_config(args: argparse.Namespace, required_start: dt.date) -> RuntimeCo
         category_kpi_table_id=category_kpi_table_id,
         category_kpi_table_name=category_kpi_table_name,
         orders_table=getattr(args, "orders_table", None),
+        airtable_cache_dir=None if args.no_cache else args.airtable_cache_dir,
+        airtable_cache_ttl=args.airtable_cache_ttl,
     )
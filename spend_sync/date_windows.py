@@ -3,10 +3,11 @@ import calendar
 from typing import Tuple
 
 DUBAI_OFFSET = dt.timedelta(hours=4)
+DUBAI_TZ = dt.timezone(DUBAI_OFFSET)
 
 
 def dubai_now() -> dt.datetime:
-    return dt.datetime.utcnow() + DUBAI_OFFSET
+    return dt.datetime.now(DUBAI_TZ)
 
 
 def first_weekday_of_month(year: int, month: int, weekday: int) -> int:
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+
+class DiskCache:
+    """JSON-file cache with a per-entry time-to-live, keyed by a hash of the request."""
+
+    def __init__(self, directory: str, ttl_seconds: float) -> None:
+        self.directory = Path(directory).expanduser()
+        self.ttl_seconds = float(ttl_seconds)
+
+    def _path(self, key: Sequence[object]) -> Path:
+        digest = hashlib.sha256(json.dumps(list(key), sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return self.directory / f"{digest}.json"
+
+    def get(self, key: Sequence[object], max_age: Optional[float] = None) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with path.open("r", encoding="utf-8") as handle:
+                entry = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        ttl = self.ttl_seconds if max_age is None else max_age
+        if time.time() - float(entry.get("stored_at", 0)) > ttl:
+            return None
+        return entry.get("value")
+
+    def set(self, key: Sequence[object], value: Any) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as handle:
+            json.dump({"stored_at": time.time(), "value": value}, handle)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: Sequence[object]) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
@@ -18,10 +18,12 @@ def parse_numeric(value) -> float:
 
 
 def sum_spend_for_month(rows: Iterable[SpendRow], year: int, month: int, day_limit: int) -> int:
+    # SpendRow dates are ISO strings, so the window reduces to a prefix plus a string upper bound.
+    prefix = f"{year:04d}-{month:02d}-"
+    upper = min(f"{prefix}{day_limit:02d}", dt.date.today().isoformat())
     total = 0
     for row in rows:
-        date = dt.datetime.strptime(row.date, "%Y-%m-%d").date()
-        if date.year == year and date.month == month and date.day <= day_limit and date <= dt.date.today():
+        if row.date.startswith(prefix) and row.date <= upper:
             total += row.amount
     return total
 
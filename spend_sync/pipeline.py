@@ -1,33 +1,50 @@
 import datetime as dt
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from typing import Dict, List, Tuple
 
 from .airtable_client import AirtableClient
 from .config import RuntimeConfig
 from .date_windows import daily_windows, dubai_now, monthly_windows, required_start_date
 from .category_kpi import update_category_monthly_counts
+from .disk_cache import DiskCache
 from .kpi import update_daily_cac, update_monthly_cac
-from .sources import SpendRow, fetch_google_sheet_daily, fetch_meta_daily
+from .sources import META_BATCH_MIN_ACCOUNTS, SpendRow, fetch_google_sheet_daily, fetch_meta_daily, fetch_meta_daily_batch
+
+SPEND_FETCH_WORKERS = 8
 
 
 def fetch_spend(config: RuntimeConfig, start_date: dt.date, end_date: dt.date) -> List[SpendRow]:
     start_str = start_date.isoformat()
     end_str = end_date.isoformat()
-    rows: List[SpendRow] = []
 
-    for account_id in config.meta_account_ids:
-        rows.extend(
-            fetch_meta_daily(
+    # Each source is independent network I/O; the Meta calls still share one rate limiter.
+    if len(config.meta_account_ids) >= META_BATCH_MIN_ACCOUNTS:
+        fetches = [
+            partial(
+                fetch_meta_daily_batch,
+                access_token=config.meta_access_token,
+                account_ids=list(config.meta_account_ids),
+                start_date=start_str,
+                end_date=end_str,
+            )
+        ]
+    else:
+        fetches = [
+            partial(
+                fetch_meta_daily,
                 access_token=config.meta_access_token,
                 account_id=account_id,
                 start_date=start_str,
                 end_date=end_str,
             )
-        )
-
+            for account_id in config.meta_account_ids
+        ]
     if config.google_sheet_url and config.google_account_id:
-        rows.extend(
-            fetch_google_sheet_daily(
+        fetches.append(
+            partial(
+                fetch_google_sheet_daily,
                 sheet_url=config.google_sheet_url,
                 account_id=config.google_account_id,
                 start_date=start_str,
@@ -35,28 +52,40 @@ def fetch_spend(config: RuntimeConfig, start_date: dt.date, end_date: dt.date) -
             )
         )
 
+    rows: List[SpendRow] = []
+    if fetches:
+        with ThreadPoolExecutor(max_workers=min(SPEND_FETCH_WORKERS, len(fetches))) as pool:
+            futures = [pool.submit(fetch) for fetch in fetches]
+            # Collect in submission order so rows with equal sort keys keep their old order.
+            for future in futures:
+                rows.extend(future.result())
+
     rows.sort(key=lambda r: (r.account_id, r.date))
     return rows
 
 
+@lru_cache(maxsize=1024)
+def _iso_to_us(date: str) -> str:
+    # Spend rows repeat a few dozen dates; keep strptime so unpadded sheet dates still parse.
+    return dt.datetime.strptime(date, "%Y-%m-%d").strftime("%m/%d/%Y")
+
+
+def _spend_record(row: SpendRow, identifier: str, pulled_at: str) -> Dict:
+    return {
+        "fields": {
+            "id": identifier,
+            "date": row.date,
+            "account_id": row.account_id,
+            "currency": row.currency,
+            "spend": row.amount,
+            "pulled_at": pulled_at,
+            "platform": row.platform,
+        }
+    }
+
+
 def to_airtable_payload(rows: List[SpendRow], pulled_at: str) -> List[Dict]:
-    payload = []
-    for row in rows:
-        identifier = f"{dt.datetime.strptime(row.date, '%Y-%m-%d').strftime('%m/%d/%Y')} - {row.account_id}"
-        payload.append(
-            {
-                "fields": {
-                    "id": identifier,
-                    "date": row.date,
-                    "account_id": row.account_id,
-                    "currency": row.currency,
-                    "spend": row.amount,
-                    "pulled_at": pulled_at,
-                    "platform": row.platform,
-                }
-            }
-        )
-    return payload
+    return [_spend_record(row, f"{_iso_to_us(row.date)} - {row.account_id}", pulled_at) for row in rows]
 
 
 def aggregate_by_date(rows: List[SpendRow]) -> Dict[str, int]:
@@ -66,6 +95,29 @@ def aggregate_by_date(rows: List[SpendRow]) -> Dict[str, int]:
     return totals
 
 
+def _build_outputs(
+    rows: List[SpendRow],
+    fact_start_iso: str,
+    pulled_at: str,
+    with_payload: bool,
+    with_csv: bool,
+) -> Tuple[List[Dict], Dict[str, int], List[List[object]]]:
+    """Build the fact-table payload, per-date totals and CSV rows in one pass over rows."""
+    payload: List[Dict] = []
+    totals: Dict[str, int] = defaultdict(int)
+    csv_rows: List[List[object]] = []
+    for row in rows:
+        totals[row.date] += row.amount
+        if not with_csv and not (with_payload and row.date >= fact_start_iso):
+            continue
+        identifier = f"{_iso_to_us(row.date)} - {row.account_id}"
+        if with_payload and row.date >= fact_start_iso:
+            payload.append(_spend_record(row, identifier, pulled_at))
+        if with_csv:
+            csv_rows.append([identifier, row.date, row.account_id, row.currency, row.amount, pulled_at, row.platform])
+    return payload, totals, csv_rows
+
+
 def compute_required_start(now: dt.datetime) -> dt.date:
     return required_start_date(now)
 
@@ -75,12 +127,17 @@ def run_pipeline(config: RuntimeConfig) -> None:
     required_start = compute_required_start(now)
     kpi_rows = fetch_spend(config, required_start, config.fact_end_date)
     fact_start_iso = config.fact_start_date.isoformat()
-    fact_rows = [row for row in kpi_rows if row.date >= fact_start_iso]
-    rows = kpi_rows
-    pulled_at = now.replace(microsecond=0).isoformat() + "Z"
+    pulled_at = now.replace(microsecond=0, tzinfo=None).isoformat() + "Z"
+    payload, spend_by_date, csv_rows = _build_outputs(
+        kpi_rows,
+        fact_start_iso,
+        pulled_at,
+        with_payload=not config.skip_airtable,
+        with_csv=bool(config.csv_path),
+    )
     if not config.skip_airtable:
-        airtable = AirtableClient(config.airtable_api_key, config.airtable_base_id)
-        payload = to_airtable_payload(fact_rows, pulled_at)
+        cache = DiskCache(config.airtable_cache_dir, config.airtable_cache_ttl) if config.airtable_cache_dir else None
+        airtable = AirtableClient(config.airtable_api_key, config.airtable_base_id, cache=cache)
         table_identifier = config.airtable_table_id or config.airtable_table_name or ""
         airtable.upsert_by_id(table_identifier, payload)
 
@@ -98,7 +155,6 @@ def run_pipeline(config: RuntimeConfig) -> None:
         if config.daily_kpi_table_id or config.daily_kpi_table_name:
             today, previous_day = daily_windows(now)
             table = config.daily_kpi_table_id or config.daily_kpi_table_name or ""
-            spend_by_date = aggregate_by_date(kpi_rows)
             update_daily_cac(
                 airtable,
                 table,
@@ -127,6 +183,4 @@ def run_pipeline(config: RuntimeConfig) -> None:
         with path.open("w", newline="", encoding="utf-8") as handle:
             writer = csv.writer(handle)
             writer.writerow(["id", "date", "account_id", "currency", "spend", "pulled_at", "platform"])
-            for row in rows:
-                identifier = f"{dt.datetime.strptime(row.date, '%Y-%m-%d').strftime('%m/%d/%Y')} - {row.account_id}"
-                writer.writerow([identifier, row.date, row.account_id, row.currency, row.amount, pulled_at, row.platform])
+            writer.writerows(csv_rows)
@@ -0,0 +1,27 @@
+import threading
+import time
+from collections import deque
+from typing import Deque
+
+
+class RateLimiter:
+    """Simple token bucket style limiter that caps requests per time window."""
+
+    def __init__(self, max_calls: int, per_seconds: float) -> None:
+        self.max_calls = max(1, int(max_calls))
+        self.per_seconds = max(0.1, float(per_seconds))
+        self._lock = threading.Lock()
+        self._timestamps: Deque[float] = deque()
+
+    def wait(self) -> None:
+        """Block until a request slot is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._timestamps and now - self._timestamps[0] >= self.per_seconds:
+                    self._timestamps.popleft()
+                if len(self._timestamps) < self.max_calls:
+                    self._timestamps.append(now)
+                    return
+                sleep_for = self.per_seconds - (now - self._timestamps[0])
+            time.sleep(max(0.05, min(sleep_for, 5.0)))
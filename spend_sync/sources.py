@@ -1,52 +1,59 @@
 import csv
 import datetime as dt
+import itertools
 import logging
 import os
 import re
 import threading
 import time
-from collections import defaultdict, deque
+from collections import defaultdict
 from dataclasses import dataclass
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
-from io import StringIO
-from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN, ROUND_HALF_UP
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from . import json_codec
+from .rate_limiter import RateLimiter
+
+META_GRAPH_URL = "https://graph.facebook.com"
 META_API_VERSION = "v23.0"
 META_RATE_LIMIT_ENV_VAR = "META_MAX_CALLS_PER_MINUTE"
 META_DEFAULT_CALLS_PER_MINUTE = 60
 META_MAX_RETRIES = 5
 META_BASE_BACKOFF_SECONDS = 15
 META_MAX_BACKOFF_SECONDS = 300
-
-
-class RateLimiter:
-    """Simple token bucket style limiter that caps requests per time window."""
-
-    def __init__(self, max_calls: int, per_seconds: float) -> None:
-        self.max_calls = max(1, int(max_calls))
-        self.per_seconds = max(0.1, float(per_seconds))
-        self._lock = threading.Lock()
-        self._timestamps: Deque[float] = deque()
-
-    def wait(self) -> None:
-        """Block until a request slot is available."""
-        while True:
-            with self._lock:
-                now = time.monotonic()
-                while self._timestamps and now - self._timestamps[0] >= self.per_seconds:
-                    self._timestamps.popleft()
-                if len(self._timestamps) < self.max_calls:
-                    self._timestamps.append(now)
-                    return
-                sleep_for = self.per_seconds - (now - self._timestamps[0])
-            time.sleep(max(0.05, min(sleep_for, 5.0)))
+META_BATCH_MAX_REQUESTS = 50
+# Below this many accounts the batch envelope saves too little to be worth it.
+META_BATCH_MIN_ACCOUNTS = 3
+HTTP_POOL_SIZE = 16
+_CENTS = Decimal("0.01")
+_COST_CLEAN_RE = re.compile(r"[^\d.\-]")
 
 
 logger = logging.getLogger(__name__)
 _meta_rate_limiter: Optional[RateLimiter] = None
 _meta_rate_limiter_lock = threading.Lock()
+_http_session: Optional[requests.Session] = None
+_http_session_lock = threading.Lock()
+
+
+def _get_http_session() -> requests.Session:
+    # Shared across Meta pages, accounts and the sheet download so connections are reused.
+    global _http_session
+    if _http_session is not None:
+        return _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            # Retries stay in _request_meta_insights, which understands Meta's throttling responses.
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            _http_session = session
+    return _http_session
 
 
 def _get_meta_rate_limiter() -> RateLimiter:
@@ -102,7 +109,7 @@ def _meta_retry_delay(resp: requests.Response, attempt: int) -> Optional[float]:
     if status == 403:
         error: Dict[str, Any] = {}
         try:
-            payload = resp.json()
+            payload = json_codec.loads(resp.content)
             if isinstance(payload, dict):
                 error_obj = payload.get("error")
                 if isinstance(error_obj, dict):
@@ -124,12 +131,22 @@ def _meta_retry_delay(resp: requests.Response, attempt: int) -> Optional[float]:
     return None
 
 
-def _request_meta_insights(url: str, params: Optional[Dict[str, Any]]) -> requests.Response:
+def _request_meta_insights(
+    url: str,
+    params: Optional[Dict[str, Any]],
+    data: Optional[Dict[str, Any]] = None,
+    calls: int = 1,
+) -> requests.Response:
     last_status = None
     last_text = None
     for attempt in range(1, META_MAX_RETRIES + 1):
-        _get_meta_rate_limiter().wait()
-        resp = requests.get(url, params=params, timeout=120)
+        # Meta meters each request inside a batch, so a batch takes one slot per sub-request.
+        for _ in range(calls):
+            _get_meta_rate_limiter().wait()
+        if data is None:
+            resp = _get_http_session().get(url, params=params, timeout=120)
+        else:
+            resp = _get_http_session().post(url, data=data, timeout=120)
         if resp.status_code < 400:
             return resp
         last_status = resp.status_code
@@ -157,6 +174,8 @@ class SourceError(RuntimeError):
 
 @dataclass
 class SpendRow:
+    __slots__ = ("date", "account_id", "currency", "amount", "platform")
+
     date: str
     account_id: str
     currency: str
@@ -165,27 +184,55 @@ class SpendRow:
 
 
 def round_currency(value: str) -> Decimal:
-    return Decimal(value).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-
-
-def fetch_meta_daily(
-    access_token: str,
-    account_id: str,
-    start_date: str,
-    end_date: str,
-    platform_label: str = "meta",
-) -> List[SpendRow]:
-    url = f"https://graph.facebook.com/{META_API_VERSION}/act_{account_id}/insights"
-    params = {
+    return Decimal(value).quantize(_CENTS, rounding=ROUND_HALF_UP)
+
+
+def _meta_spend_to_int(value: str) -> int:
+    # Cents first, then whole units half-even; rounding straight to units would differ on e.g. 1.495.
+    whole, _, fraction = value.partition(".")
+    digits = whole + fraction
+    if whole and len(whole) <= 18 and digits.isascii() and digits.isdigit():
+        # Meta sends plain non-negative decimals, so do the same two roundings with integers.
+        cents = int(whole) * 100 + int(fraction[:2].ljust(2, "0"))
+        if fraction[2:3] >= "5":
+            cents += 1
+        units, remainder = divmod(cents, 100)
+        if remainder > 50 or (remainder == 50 and units % 2):
+            units += 1
+        return units
+    return int(round_currency(value).to_integral_value(ROUND_HALF_EVEN))
+
+
+def _meta_insights_params(start_date: str, end_date: str) -> Dict[str, Any]:
+    return {
         "fields": "spend,account_currency,date_start",
         "time_increment": 1,
         "level": "account",
         "time_range[since]": start_date,
         "time_range[until]": end_date,
-        "access_token": access_token,
         "limit": 1000,
     }
 
+
+def _parse_meta_page(payload: Dict[str, Any], account_id: str, platform_label: str) -> List[SpendRow]:
+    rows: List[SpendRow] = []
+    for record in payload.get("data", []):
+        date = record.get("date_start")
+        spend = record.get("spend", "0") or "0"
+        currency = record.get("account_currency") or "AED"
+        if not date:
+            continue
+        amount = _meta_spend_to_int(spend)
+        rows.append(SpendRow(date=date, account_id=account_id, currency=currency, amount=amount, platform=platform_label))
+    return rows
+
+
+def _fetch_meta_pages(
+    url: str,
+    params: Optional[Dict[str, Any]],
+    account_id: str,
+    platform_label: str,
+) -> List[SpendRow]:
     rows: List[SpendRow] = []
     next_url: Optional[str] = url
     first = True
@@ -193,22 +240,99 @@ def fetch_meta_daily(
         resp = _request_meta_insights(next_url, params if first else None)
         first = False
 
-        payload = resp.json()
-        for record in payload.get("data", []):
-            date = record.get("date_start")
-            spend = record.get("spend", "0") or "0"
-            currency = record.get("account_currency") or "AED"
-            if not date:
-                continue
-            amount = int(round_currency(spend).quantize(Decimal("1")))
-            rows.append(SpendRow(date=date, account_id=account_id, currency=currency, amount=amount, platform=platform_label))
-
+        payload = json_codec.loads(resp.content)
+        rows.extend(_parse_meta_page(payload, account_id, platform_label))
         next_url = payload.get("paging", {}).get("next")
+    return rows
+
 
+def fetch_meta_daily(
+    access_token: str,
+    account_id: str,
+    start_date: str,
+    end_date: str,
+    platform_label: str = "meta",
+) -> List[SpendRow]:
+    url = f"{META_GRAPH_URL}/{META_API_VERSION}/act_{account_id}/insights"
+    params = {**_meta_insights_params(start_date, end_date), "access_token": access_token}
+    rows = _fetch_meta_pages(url, params, account_id, platform_label)
     rows.sort(key=lambda r: r.date)
     return rows
 
 
+def _parse_batch_response(response: object) -> Optional[Dict[str, Any]]:
+    # Failed or timed-out sub-requests come back as an error code or as null.
+    if not isinstance(response, dict) or response.get("code") != 200:
+        return None
+    try:
+        payload = json_codec.loads(response.get("body") or "")
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def fetch_meta_daily_batch(
+    access_token: str,
+    account_ids: List[str],
+    start_date: str,
+    end_date: str,
+    platform_label: str = "meta",
+) -> List[SpendRow]:
+    """Fetch several accounts through Graph batch requests, one cursor step per round trip.
+
+    Any account whose sub-request fails is refetched on its own through fetch_meta_daily,
+    which carries the usual throttling retries.
+    """
+    query = urlencode(_meta_insights_params(start_date, end_date))
+    version_prefix = f"{META_GRAPH_URL}/{META_API_VERSION}/"
+    # Keyed by position so a repeated account id still yields its rows twice, as separate fetches would.
+    rows_by_slot: Dict[int, List[SpendRow]] = {slot: [] for slot in range(len(account_ids))}
+    pending = {slot: f"act_{account_id}/insights?{query}" for slot, account_id in enumerate(account_ids)}
+    fallback: List[int] = []
+
+    while pending:
+        slots = list(pending)[:META_BATCH_MAX_REQUESTS]
+        batch = [{"method": "GET", "relative_url": pending.pop(slot)} for slot in slots]
+        try:
+            resp = _request_meta_insights(
+                version_prefix,
+                None,
+                data={"access_token": access_token, "batch": json_codec.dumps(batch).decode("utf-8")},
+                calls=len(batch),
+            )
+            responses = json_codec.loads(resp.content)
+            if not isinstance(responses, list):
+                raise ValueError("batch reply is not a list")
+        except (SourceError, ValueError) as exc:
+            logger.warning("Meta batch request failed (%s); fetching %s accounts individually.", exc, len(slots))
+            fallback.extend(slots)
+            continue
+
+        for slot, response in zip(slots, responses):
+            payload = _parse_batch_response(response)
+            if payload is None:
+                fallback.append(slot)
+                continue
+            rows_by_slot[slot].extend(_parse_meta_page(payload, account_ids[slot], platform_label))
+            next_url = payload.get("paging", {}).get("next")
+            if next_url and next_url.startswith(version_prefix):
+                pending[slot] = next_url[len(version_prefix) :]
+            elif next_url:
+                rows_by_slot[slot].extend(_fetch_meta_pages(next_url, None, account_ids[slot], platform_label))
+        # Sub-responses missing from a short reply are retried individually too.
+        fallback.extend(slots[len(responses) :])
+
+    for slot in fallback:
+        rows_by_slot[slot] = fetch_meta_daily(access_token, account_ids[slot], start_date, end_date, platform_label)
+
+    rows: List[SpendRow] = []
+    for slot in range(len(account_ids)):
+        account_rows = rows_by_slot[slot]
+        account_rows.sort(key=lambda r: r.date)
+        rows.extend(account_rows)
+    return rows
+
+
 def _normalize_header(value: str) -> str:
     return "".join(ch for ch in (value or "").lower() if ch.isalnum())
 
@@ -222,7 +346,10 @@ def _parse_cost_value(value: object) -> Optional[Decimal]:
     normalized = text.replace(",", "")
     if normalized.startswith("(") and normalized.endswith(")"):
         normalized = f"-{normalized[1:-1]}"
-    normalized = re.sub(r"[^\d.\-]", "", normalized)
+    unsigned = normalized[1:] if normalized.startswith("-") else normalized
+    # Typical exports are already plain numbers; only scrub currency symbols and the like when needed.
+    if not unsigned.replace(".", "", 1).isdecimal():
+        normalized = _COST_CLEAN_RE.sub("", normalized)
     if normalized in {"", "-", ".", "-.", ".-"}:
         return None
     try:
@@ -231,54 +358,50 @@ def _parse_cost_value(value: object) -> Optional[Decimal]:
         return None
 
 
-def fetch_google_sheet_daily(
-    sheet_url: str,
-    account_id: str,
-    start_date: str,
-    end_date: str,
-    platform_label: str = "google_ads",
-    currency: str = "AED",
-) -> List[SpendRow]:
-    if not sheet_url:
-        return []
+@lru_cache(maxsize=4096)
+def _sheet_date_to_iso(date_raw: str) -> Optional[str]:
+    # Sheets repeat each date across many campaign rows, so parse each spelling once.
+    if "-" in date_raw:
+        return date_raw
+    try:
+        return dt.datetime.strptime(date_raw, "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
 
-    resp = requests.get(sheet_url, timeout=60)
-    if resp.status_code >= 400:
-        raise SourceError(f"Google sheet fetch error {resp.status_code}: {resp.text}")
-
-    text = resp.text.splitlines()
-    filtered: List[str] = []
-    header_found = False
-    for line in text:
-        normalized = line.strip().lower()
-        if not header_found:
-            if normalized.startswith("date") and "," in line:
-                header_found = True
-                filtered.append(line)
-        else:
-            filtered.append(line)
 
-    if not header_found:
+def _sum_sheet_costs(lines: Iterator[str], start_date: str, end_date: str) -> Dict[str, Decimal]:
+    # Exports start with a few title rows; the CSV proper begins at the Date header.
+    for line in lines:
+        if line.lstrip()[:4].lower() == "date" and "," in line:
+            header_line = line
+            break
+    else:
         raise SourceError("Google sheet missing header row.")
 
-    reader = csv.DictReader(StringIO("\n".join(filtered)))
-    normalized_headers = {_normalize_header(col): col for col in reader.fieldnames or []}
+    reader = csv.reader(itertools.chain((header_line,), lines))
+    fieldnames = next(reader)
+    # Later duplicates win, as they did when rows were read into dicts.
+    column_index = {name: index for index, name in enumerate(fieldnames)}
+    normalized_headers = {_normalize_header(col): col for col in fieldnames}
     date_col = normalized_headers.get("date")
     cost_col = normalized_headers.get("costmicros") or normalized_headers.get("cost") or normalized_headers.get("amount")
     if not date_col or not cost_col:
         raise SourceError("Google sheet missing Date or Cost column.")
+    date_index = column_index[date_col]
+    cost_index = column_index[cost_col]
 
     totals: Dict[str, Decimal] = defaultdict(lambda: Decimal("0"))
     total_rows = 0
     for row in reader:
+        if not row:
+            continue
         total_rows += 1
-        date_raw = (row.get(date_col) or "").strip()
-        cost_raw = row.get(cost_col)
+        date_raw = row[date_index].strip() if date_index < len(row) else ""
+        cost_raw = row[cost_index] if cost_index < len(row) else None
         if not date_raw:
             continue
-        try:
-            parsed = date_raw if "-" in date_raw else dt.datetime.strptime(date_raw, "%d/%m/%Y").strftime("%Y-%m-%d")
-        except Exception:
+        parsed = _sheet_date_to_iso(date_raw)
+        if parsed is None:
             continue
         if parsed < start_date or parsed > end_date:
             continue
@@ -288,12 +411,33 @@ def fetch_google_sheet_daily(
             continue
         totals[parsed] += cost_decimal
 
+    return totals
+
+
+def fetch_google_sheet_daily(
+    sheet_url: str,
+    account_id: str,
+    start_date: str,
+    end_date: str,
+    platform_label: str = "google_ads",
+    currency: str = "AED",
+) -> List[SpendRow]:
+    if not sheet_url:
+        return []
+
+    with _get_http_session().get(sheet_url, timeout=60, stream=True) as resp:
+        if resp.status_code >= 400:
+            raise SourceError(f"Google sheet fetch error {resp.status_code}: {resp.text}")
+        if resp.encoding is None:
+            resp.encoding = "utf-8"
+        totals = _sum_sheet_costs(resp.iter_lines(decode_unicode=True), start_date, end_date)
+
     rows = [
         SpendRow(
             date=date,
             account_id=account_id,
             currency=currency,
-            amount=int(amount.quantize(Decimal("1"), rounding=ROUND_HALF_UP)),
+            amount=int(amount.to_integral_value(ROUND_HALF_UP)),
             platform=platform_label,
         )
         for date, amount in sorted(totals.items())